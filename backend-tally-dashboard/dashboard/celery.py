@@ -3,6 +3,7 @@ Celery configuration for background task processing
 """
 import os
 from celery import Celery
+from celery.schedules import crontab
 from django.conf import settings
 
 # Set default Django settings
@@ -17,6 +18,22 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 # Auto-discover tasks from all installed apps
 app.autodiscover_tasks()
 
+# Periodic tasks (run with: celery -A dashboard beat -l info)
+app.conf.beat_schedule = {}
+
+# Credit deduction runs on beat only when it replaces the in-process scheduler
+if getattr(settings, 'CREDIT_SCHEDULER_BACKEND', 'thread') == 'celery':
+    app.conf.beat_schedule.update({
+        'credits-hourly': {
+            'task': 'excel_data.tasks.process_all_credits_task',
+            'schedule': crontab(minute=0),
+        },
+        'credits-midnight-ist': {
+            'task': 'excel_data.tasks.process_all_credits_task',
+            'schedule': crontab(hour=18, minute=30),  # 18:30 UTC == 00:00 IST
+        },
+    })
+
 
 @app.task(bind=True, ignore_result=True)
 def debug_task(self):
@@ -87,6 +87,11 @@ WSGI_APPLICATION = 'dashboard.wsgi.application'
 # Custom User Model
 AUTH_USER_MODEL = 'excel_data.CustomUser'
 
+# Load the session user with its tenant joined
+AUTHENTICATION_BACKENDS = [
+    'excel_data.backends.TenantModelBackend',
+]
+
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
@@ -185,6 +190,11 @@ SIMPLE_JWT = {
 
 # Background task processing (Celery is not used - using thread-based fallback)
 CELERY_ENABLED = False
+CELERY_TIMEZONE = 'UTC'
+
+# Credit deduction scheduler: 'thread' (in-process CreditScheduler) or 'celery'
+# (Celery beat, requires a running `celery -A dashboard beat` process)
+CREDIT_SCHEDULER_BACKEND = config('CREDIT_SCHEDULER_BACKEND', default='thread')
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
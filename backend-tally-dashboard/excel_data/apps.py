@@ -11,6 +11,10 @@ class ExcelDataConfig(AppConfig):
         # Import signals
         import excel_data.signals  # noqa
         
+        # Credit deduction is scheduled by Celery beat instead
+        if getattr(settings, 'CREDIT_SCHEDULER_BACKEND', 'thread') == 'celery':
+            return
+        
         # Start credit scheduler (only in main process, not in reloader)
         # Check if we're in the main process (not the reloader process)
         if os.environ.get('RUN_MAIN') != 'true' and not settings.DEBUG:
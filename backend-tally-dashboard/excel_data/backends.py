@@ -0,0 +1,23 @@
+"""
+Authentication backends
+"""
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+UserModel = get_user_model()
+
+
+class TenantModelBackend(ModelBackend):
+    """
+    ModelBackend that loads the session user together with its tenant.
+
+    The credit middlewares read request.user.tenant on every request; joining
+    the tenant here avoids a second query per request to fetch it.
+    """
+
+    def get_user(self, user_id):
+        try:
+            user = UserModel._default_manager.select_related('tenant').get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
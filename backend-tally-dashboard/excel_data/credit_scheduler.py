@@ -7,84 +7,70 @@ Runs credit deduction checks:
 """
 
 import threading
-import time
 import logging
-from datetime import datetime, time as datetime_time
+from datetime import datetime, timedelta, time as datetime_time
 from django.utils import timezone
 import pytz
-from django.db import connection
+from django.db import OperationalError, close_old_connections, connection
 
 logger = logging.getLogger(__name__)
 
+IST = pytz.timezone('Asia/Kolkata')
+
 
 class CreditScheduler:
     """
     Background scheduler for credit deduction.
-    Runs in a separate daemon thread.
+    Runs in a separate daemon thread that sleeps until the next check is due.
     """
     
     def __init__(self):
         self.running = False
         self.thread = None
+        self._wake_event = threading.Event()
         self.last_hourly_check = None
-        self.last_midnight_check = None
+        self.next_midnight_check = None
         
     def process_all_credits(self):
-        """Process credits for all active tenants"""
+        """Deduct credits for all active tenants in one set-oriented update"""
         try:
             # Import here to avoid circular imports
             from excel_data.models import Tenant
             
-            # Close old connections
-            connection.close()
-            
-            tenants = Tenant.objects.filter(is_active=True, credits__gt=0)
-            total = tenants.count()
-            processed = 0
-            deducted = 0
-            
-            logger.info(f"🔄 Credit scheduler: Processing {total} active tenants")
+            # Reuse the persistent connection; only drop it if it is unusable
+            # or older than CONN_MAX_AGE
+            close_old_connections()
             
-            for tenant in tenants:
-                try:
-                    was_deducted = tenant.deduct_daily_credit()
-                    processed += 1
-                    if was_deducted:
-                        deducted += 1
-                except Exception as e:
-                    logger.error(f"Error processing tenant {tenant.id}: {str(e)}")
+            try:
+                deducted, deactivated = Tenant.deduct_all_daily_credits()
+            except OperationalError:
+                # Connection went stale while idle - reconnect and retry once
+                connection.close()
+                deducted, deactivated = Tenant.deduct_all_daily_credits()
             
             if deducted > 0:
-                logger.info(f"✅ Credit scheduler: Processed {processed}/{total} tenants, {deducted} credits deducted")
+                logger.info(
+                    f"✅ Credit scheduler: Deducted credits from {deducted} tenants, "
+                    f"{deactivated} deactivated"
+                )
             else:
-                logger.debug(f"Credit scheduler: Processed {processed}/{total} tenants, no deductions needed")
+                logger.debug("Credit scheduler: No deductions needed")
                 
-            return processed, deducted
+            return deducted, deactivated
             
         except Exception as e:
             logger.error(f"Error in credit scheduler: {str(e)}", exc_info=True)
             return 0, 0
     
+    def compute_next_midnight(self):
+        """Next 00:00:00 IST, expressed in UTC"""
+        tomorrow_ist = timezone.now().astimezone(IST).date() + timedelta(days=1)
+        return IST.localize(datetime.combine(tomorrow_ist, datetime_time(0, 0, 0))).astimezone(pytz.utc)
+    
     def should_run_midnight_check(self):
         """Check if we should run the midnight check"""
-        ist = pytz.timezone('Asia/Kolkata')
-        now_ist = timezone.now().astimezone(ist)
-        current_time = now_ist.time()
-        current_date = now_ist.date()
-        
-        # Check if it's between 00:00:00 and 00:05:00 (5 minute window)
-        midnight_start = datetime_time(0, 0, 0)
-        midnight_end = datetime_time(0, 5, 0)
-        
-        is_midnight_window = midnight_start <= current_time <= midnight_end
-        
-        # Check if we haven't run today
-        already_ran_today = (
-            self.last_midnight_check is not None and 
-            self.last_midnight_check >= current_date
-        )
-        
-        return is_midnight_window and not already_ran_today
+        # Trigger instant is precomputed, so no timezone conversion here
+        return self.next_midnight_check is not None and timezone.now() >= self.next_midnight_check
     
     def should_run_hourly_check(self):
         """Check if we should run the hourly check"""
@@ -96,44 +82,49 @@ class CreditScheduler:
         time_diff = (now - self.last_hourly_check).total_seconds()
         return time_diff >= 3600  # 1 hour = 3600 seconds
     
+    def seconds_until_next_check(self):
+        """Seconds until the next hourly or midnight (IST) check is due"""
+        next_hourly = self.last_hourly_check + timedelta(hours=1)
+        next_check = min(next_hourly, self.next_midnight_check)
+        return max(timedelta(0), next_check - timezone.now()).total_seconds()
+    
     def run(self):
         """Main scheduler loop"""
-        ist = pytz.timezone('Asia/Kolkata')
         logger.info("🚀 Credit scheduler started")
         
         # Run immediately on startup
         logger.info("🌟 Running credit check on startup...")
         self.process_all_credits()
         self.last_hourly_check = timezone.now()
-        self.last_midnight_check = timezone.now().astimezone(ist).date()
+        self.next_midnight_check = self.compute_next_midnight()
         
         while self.running:
             try:
                 # Check if we should run midnight check
                 if self.should_run_midnight_check():
-                    ist_now = timezone.now().astimezone(ist)
+                    ist_now = timezone.now().astimezone(IST)
                     logger.info(f"🌙 Running midnight credit check at {ist_now.strftime('%H:%M:%S IST')}")
-                    processed, deducted = self.process_all_credits()
-                    self.last_midnight_check = ist_now.date()
+                    deducted, deactivated = self.process_all_credits()
+                    self.next_midnight_check = self.compute_next_midnight()
                     
                     if deducted > 0:
-                        logger.info(f"🌙 Midnight check complete: {deducted} credits deducted")
+                        logger.info(f"🌙 Midnight check complete: {deducted} tenants charged")
                 
                 # Check if we should run hourly check
                 elif self.should_run_hourly_check():
                     logger.info("⏰ Running hourly credit check...")
-                    processed, deducted = self.process_all_credits()
+                    deducted, deactivated = self.process_all_credits()
                     self.last_hourly_check = timezone.now()
                     
                     if deducted > 0:
-                        logger.info(f"⏰ Hourly check complete: {deducted} credits deducted")
+                        logger.info(f"⏰ Hourly check complete: {deducted} tenants charged")
                 
-                # Sleep for 1 minute before next check
-                time.sleep(60)
+                # Sleep until the next check is due (stop() wakes us early)
+                self._wake_event.wait(self.seconds_until_next_check())
                 
             except Exception as e:
                 logger.error(f"Error in credit scheduler loop: {str(e)}", exc_info=True)
-                time.sleep(60)  # Wait a minute before retrying
+                self._wake_event.wait(60)  # Wait a minute before retrying
     
     def start(self):
         """Start the scheduler in a daemon thread"""
@@ -142,6 +133,7 @@ class CreditScheduler:
             return
         
         self.running = True
+        self._wake_event.clear()
         self.thread = threading.Thread(target=self.run, daemon=True)
         self.thread.start()
         logger.info("Credit scheduler thread started")
@@ -149,6 +141,7 @@ class CreditScheduler:
     def stop(self):
         """Stop the scheduler"""
         self.running = False
+        self._wake_event.set()
         if self.thread:
             self.thread.join(timeout=5)
         logger.info("Credit scheduler stopped")
@@ -5,14 +5,27 @@ Usage: python manage.py check_credits
 
 from django.core.management.base import BaseCommand
 from django.utils import timezone
+from django.db.models import Count, Q
 from excel_data.models import Tenant
+from excel_data.models.tenant import IST
+from excel_data.middleware.credit_check_middleware import (
+    bump_credit_check_cache_version,
+    get_credit_check_cache_version,
+)
 from django.core.cache import cache
-import pytz
 
 
 class Command(BaseCommand):
     help = 'Check credit system status and show which tenants need credit deduction'
 
+    # (icon, label) for each tenant status
+    STATUSES = (
+        ('🟢', 'ACTIVE'),
+        ('🔴', 'INACTIVE'),
+        ('⚫', 'NO CREDITS'),
+        ('🟡', 'LOW CREDITS'),
+    )
+
     def add_arguments(self, parser):
         parser.add_argument(
             '--tenant-id',
@@ -31,44 +44,55 @@ class Command(BaseCommand):
         )
 
     def handle(self, *args, **options):
-        self.stdout.write(self.style.SUCCESS('=' * 80))
-        self.stdout.write(self.style.SUCCESS('CREDIT SYSTEM STATUS CHECK'))
-        self.stdout.write(self.style.SUCCESS('=' * 80))
-        self.stdout.write('')
+        # Build the report in memory and write it out in one go
+        lines = []
+        try:
+            self._build_report(lines.append, options)
+        finally:
+            self.stdout.write('\n'.join(lines))
+
+    def _build_report(self, write, options):
+        write(self.style.SUCCESS('=' * 80))
+        write(self.style.SUCCESS('CREDIT SYSTEM STATUS CHECK'))
+        write(self.style.SUCCESS('=' * 80))
+        write('')
 
         # Clear cache if requested
         if options['clear_cache']:
-            self.stdout.write(self.style.WARNING('🧹 Clearing credit check cache...'))
-            cache_keys = cache.keys('credit_checked_*')
-            if cache_keys:
-                cache.delete_many(cache_keys)
-                self.stdout.write(self.style.SUCCESS(f'   Cleared {len(cache_keys)} cache entries'))
-            else:
-                self.stdout.write(self.style.SUCCESS('   No cache entries to clear'))
-            self.stdout.write('')
+            write(self.style.WARNING('🧹 Clearing credit check cache...'))
+            version = bump_credit_check_cache_version()
+            write(self.style.SUCCESS(f'   Shared cache entries invalidated (now on version {version})'))
+            write('   Running workers may still skip the re-check for up to 5 minutes (per-process cache)')
+            write('')
 
         # Get tenants to check
         if options['tenant_id']:
             tenants = Tenant.objects.filter(id=options['tenant_id'])
-            if not tenants.exists():
-                self.stdout.write(self.style.ERROR(f'❌ Tenant with ID {options["tenant_id"]} not found'))
+            if not tenants:
+                write(self.style.ERROR(f'❌ Tenant with ID {options["tenant_id"]} not found'))
                 return
         else:
             tenants = Tenant.objects.all().order_by('-is_active', '-credits', 'name')
 
         # Show current time info
         now_utc = timezone.now()
-        ist = pytz.timezone('Asia/Kolkata')
-        now_ist = now_utc.astimezone(ist)
+        now_ist = now_utc.astimezone(IST)
         
-        self.stdout.write(self.style.SUCCESS(f'🕐 Current Time:'))
-        self.stdout.write(f'   UTC: {now_utc.strftime("%Y-%m-%d %H:%M:%S %Z")}')
-        self.stdout.write(f'   IST: {now_ist.strftime("%Y-%m-%d %H:%M:%S %Z")}')
-        self.stdout.write('')
+        write(self.style.SUCCESS(f'🕐 Current Time:'))
+        write(f'   UTC: {now_utc.strftime("%Y-%m-%d %H:%M:%S %Z")}')
+        write(f'   IST: {now_ist.strftime("%Y-%m-%d %H:%M:%S %Z")}')
+        write('')
 
         # Display tenant information
-        self.stdout.write(self.style.SUCCESS(f'📊 Total Tenants: {tenants.count()}'))
-        self.stdout.write('')
+        # len() evaluates the queryset once; the loop below reuses the cached rows
+        write(self.style.SUCCESS(f'📊 Total Tenants: {len(tenants)}'))
+        write('')
+
+        # Fetch cache status for all tenants in one round-trip
+        cached_map = cache.get_many(
+            [f'credit_checked_{tenant.id}' for tenant in tenants],
+            version=get_credit_check_cache_version(),
+        )
 
         for tenant in tenants:
             # Check if deduction is due based on last_credit_deducted
@@ -78,83 +102,83 @@ class Command(BaseCommand):
             )
             
             # Status icon
-            if not tenant.is_active:
-                status_icon = '🔴'
-                status = 'INACTIVE'
-            elif tenant.credits == 0:
-                status_icon = '⚫'
-                status = 'NO CREDITS'
-            elif tenant.credits <= 5:
-                status_icon = '🟡'
-                status = 'LOW CREDITS'
-            else:
-                status_icon = '🟢'
-                status = 'ACTIVE'
+            status_icon, status = self.STATUSES[
+                0 if tenant.is_active and tenant.credits > 5
+                else 1 if not tenant.is_active
+                else 2 if tenant.credits == 0
+                else 3
+            ]
             
-            self.stdout.write(self.style.WARNING(f'{status_icon} Tenant: {tenant.name} (ID: {tenant.id})'))
-            self.stdout.write(f'   Status: {status}')
-            self.stdout.write(f'   Credits: {tenant.credits}')
-            self.stdout.write(f'   Active: {tenant.is_active}')
+            write(self.style.WARNING(f'{status_icon} Tenant: {tenant.name} (ID: {tenant.id})'))
+            write(f'   Status: {status}')
+            write(f'   Credits: {tenant.credits}')
+            write(f'   Active: {tenant.is_active}')
             
             # Show last credit deduction date
             if tenant.last_credit_deducted:
-                self.stdout.write(f'   Last Credit Deducted: {tenant.last_credit_deducted.strftime("%Y-%m-%d")}')
+                write(f'   Last Credit Deducted: {tenant.last_credit_deducted.strftime("%Y-%m-%d")}')
             else:
-                self.stdout.write(f'   Last Credit Deducted: Never')
+                write(f'   Last Credit Deducted: Never')
             
             # Check cache status
             cache_key = f'credit_checked_{tenant.id}'
-            cached = cache.get(cache_key)
+            cached = cached_map.get(cache_key)
             if cached:
-                self.stdout.write(f'   Cache Status: ✓ Checked recently (within last hour)')
+                write(f'   Cache Status: ✓ Checked recently (within last hour)')
             else:
-                self.stdout.write(f'   Cache Status: ✗ Not in cache')
+                write(f'   Cache Status: ✗ Not in cache')
             
             # Show if deduction is due
             if should_deduct and tenant.credits > 0:
-                self.stdout.write(self.style.WARNING(f'   ⚠️  DEDUCTION DUE: Credit will be deducted on next request'))
+                write(self.style.WARNING(f'   ⚠️  DEDUCTION DUE: Credit will be deducted on next request'))
             elif should_deduct and tenant.credits == 0:
-                self.stdout.write(f'   ℹ️  No credits to deduct')
+                write(f'   ℹ️  No credits to deduct')
             else:
-                self.stdout.write(f'   ✓ Up to date (no deduction needed today)')
+                write(f'   ✓ Up to date (no deduction needed today)')
             
             # Test deduction if requested
             if options['test_deduct'] and should_deduct and tenant.credits > 0:
-                self.stdout.write(self.style.WARNING(f'   🧪 Testing credit deduction...'))
+                write(self.style.WARNING(f'   🧪 Testing credit deduction...'))
                 was_deducted = tenant.deduct_daily_credit()
                 if was_deducted:
                     # Refresh from DB
                     tenant.refresh_from_db()
-                    self.stdout.write(self.style.SUCCESS(
+                    write(self.style.SUCCESS(
                         f'   ✅ Successfully deducted 1 credit. Remaining: {tenant.credits}'
                     ))
                     if tenant.credits == 0:
-                        self.stdout.write(self.style.ERROR(
+                        write(self.style.ERROR(
                             f'   🔴 Tenant deactivated due to zero credits'
                         ))
                 else:
-                    self.stdout.write(f'   ℹ️  No deduction performed')
+                    write(f'   ℹ️  No deduction performed')
             
-            self.stdout.write('')
+            write('')
 
         # Summary
-        self.stdout.write(self.style.SUCCESS('=' * 80))
-        self.stdout.write(self.style.SUCCESS('SUMMARY'))
-        self.stdout.write(self.style.SUCCESS('=' * 80))
+        write(self.style.SUCCESS('=' * 80))
+        write(self.style.SUCCESS('SUMMARY'))
+        write(self.style.SUCCESS('=' * 80))
         
-        active_tenants = tenants.filter(is_active=True, credits__gt=0).count()
-        inactive_tenants = tenants.filter(is_active=False).count()
-        low_credit_tenants = tenants.filter(is_active=True, credits__lte=5, credits__gt=0).count()
-        zero_credit_tenants = tenants.filter(credits=0).count()
+        stats = tenants.aggregate(
+            active=Count('id', filter=Q(is_active=True, credits__gt=0)),
+            inactive=Count('id', filter=Q(is_active=False)),
+            low=Count('id', filter=Q(is_active=True, credits__lte=5, credits__gt=0)),
+            zero=Count('id', filter=Q(credits=0)),
+        )
+        active_tenants = stats['active']
+        inactive_tenants = stats['inactive']
+        low_credit_tenants = stats['low']
+        zero_credit_tenants = stats['zero']
         
-        self.stdout.write(f'🟢 Active Tenants: {active_tenants}')
-        self.stdout.write(f'🟡 Low Credit Tenants (≤5): {low_credit_tenants}')
-        self.stdout.write(f'⚫ Zero Credit Tenants: {zero_credit_tenants}')
-        self.stdout.write(f'🔴 Inactive Tenants: {inactive_tenants}')
-        self.stdout.write('')
+        write(f'🟢 Active Tenants: {active_tenants}')
+        write(f'🟡 Low Credit Tenants (≤5): {low_credit_tenants}')
+        write(f'⚫ Zero Credit Tenants: {zero_credit_tenants}')
+        write(f'🔴 Inactive Tenants: {inactive_tenants}')
+        write('')
         
         if not options['test_deduct']:
-            self.stdout.write(self.style.SUCCESS('💡 Tip: Use --test-deduct to actually deduct credits for tenants that are due'))
-            self.stdout.write(self.style.SUCCESS('💡 Tip: Use --clear-cache to force re-check on next request'))
+            write(self.style.SUCCESS('💡 Tip: Use --test-deduct to actually deduct credits for tenants that are due'))
+            write(self.style.SUCCESS('💡 Tip: Use --clear-cache to force a re-check (takes effect within 5 minutes on running workers)'))
         
-        self.stdout.write(self.style.SUCCESS('=' * 80))
+        write(self.style.SUCCESS('=' * 80))
@@ -10,23 +10,17 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         logger.info("Starting daily credit processing for all tenants")
         
-        # Get all active tenants with credits > 0
-        tenants = Tenant.objects.filter(is_active=True, credits__gt=0)
-        total_tenants = tenants.count()
-        processed = 0
+        try:
+            deducted, deactivated = Tenant.deduct_all_daily_credits()
+        except Exception as e:
+            error_msg = f"Error processing daily credits: {str(e)}"
+            logger.error(error_msg)
+            self.stderr.write(self.style.ERROR(error_msg))
+            return
         
-        for tenant in tenants:
-            try:
-                if tenant.deduct_daily_credit():
-                    processed += 1
-                    self.stdout.write(
-                        self.style.SUCCESS(f'Successfully processed credits for tenant {tenant.name}')
-                    )
-            except Exception as e:
-                error_msg = f"Error processing credits for tenant {tenant.id}: {str(e)}"
-                logger.error(error_msg)
-                self.stderr.write(self.style.ERROR(error_msg))
-        
-        summary = f"Completed daily credit processing. Processed {processed} of {total_tenants} tenants."
+        summary = (
+            f"Completed daily credit processing. Deducted credits from {deducted} tenants, "
+            f"{deactivated} deactivated."
+        )
         logger.info(summary)
         self.stdout.write(self.style.SUCCESS(summary))
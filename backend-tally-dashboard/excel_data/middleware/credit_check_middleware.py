@@ -5,11 +5,41 @@ This ensures credits are deducted even when the server sleeps (e.g., Railway sle
 """
 
 import logging
+import threading
+import time
 from django.utils.deprecation import MiddlewareMixin
 from django.core.cache import cache
 
 logger = logging.getLogger(__name__)
 
+# Process-local record of recently checked tenants (tenant_id -> monotonic time)
+# so most requests skip the cache backend round-trip entirely
+_local_checked = {}
+_local_checked_lock = threading.Lock()
+_LOCAL_CHECKED_MAX_ENTRIES = 10000
+
+# Cache version for credit_checked_ markers; bumping it invalidates every
+# marker at once without scanning the keyspace
+CREDIT_CHECK_VERSION_KEY = 'credit_check_cache_version'
+
+
+def get_credit_check_cache_version():
+    """Return the current cache version for credit_checked_ markers"""
+    return cache.get(CREDIT_CHECK_VERSION_KEY, 1)
+
+
+def bump_credit_check_cache_version():
+    """
+    Invalidate all shared credit_checked_ markers by moving to a new cache version.
+    Per-process markers are not reachable from here and expire on their own
+    within CACHE_TIMEOUT.
+    """
+    # Written with set() rather than incr(): BaseCache.incr re-sets the key with
+    # the default timeout, which would let the version expire and reset to 1
+    version = get_credit_check_cache_version() + 1
+    cache.set(CREDIT_CHECK_VERSION_KEY, version, None)
+    return version
+
 
 class AutoCreditDeductionMiddleware(MiddlewareMixin):
     """
@@ -21,35 +51,64 @@ class AutoCreditDeductionMiddleware(MiddlewareMixin):
     How it works:
     1. On each authenticated request, checks if the tenant needs credit deduction
     2. Attempts to deduct credit (will only succeed if not already deducted today)
-    3. Uses brief cache (5 min) to prevent excessive checks during request bursts
+    3. Uses brief cache (5 min, set atomically via cache.add) to prevent excessive checks during request bursts,
+       fronted by a per-process marker so repeat requests skip the cache backend
     """
     
     CACHE_PREFIX = 'credit_checked_'
     CACHE_TIMEOUT = 300  # 5 minutes - just to prevent excessive DB queries
     
+    def _recently_checked_locally(self, tenant_id):
+        """Check the process-local marker without touching the cache backend"""
+        checked_at = _local_checked.get(tenant_id)
+        return checked_at is not None and time.monotonic() - checked_at < self.CACHE_TIMEOUT
+    
+    def _mark_checked_locally(self, tenant_id):
+        """Record the tenant as checked, pruning expired entries when the dict grows large"""
+        now = time.monotonic()
+        with _local_checked_lock:
+            if len(_local_checked) >= _LOCAL_CHECKED_MAX_ENTRIES:
+                for key, checked_at in list(_local_checked.items()):
+                    if now - checked_at >= self.CACHE_TIMEOUT:
+                        del _local_checked[key]
+            _local_checked[tenant_id] = now
+    
+    def _unmark_checked_locally(self, tenant_id):
+        """Forget the process-local marker so the next request re-checks the tenant"""
+        with _local_checked_lock:
+            _local_checked.pop(tenant_id, None)
+    
     def process_request(self, request):
         """
         Process incoming request and check credits if needed.
         """
+        tenant_id = None
+        cache_key = None
         try:
             # Only check credits for authenticated users
             if not hasattr(request, 'user') or not request.user.is_authenticated:
                 return None
             
             # Get tenant from user
-            if not hasattr(request.user, 'tenant') or not request.user.tenant:
+            tenant_id = getattr(request.user, 'tenant_id', None)
+            if not tenant_id:
                 return None
             
-            tenant = request.user.tenant
-            
-            # Check cache to prevent excessive DB hits in quick succession
-            cache_key = f"{self.CACHE_PREFIX}{tenant.id}"
-            recently_checked = cache.get(cache_key)
+            # Skip if this worker already checked the tenant recently
+            if self._recently_checked_locally(tenant_id):
+                return None
+            self._mark_checked_locally(tenant_id)
             
-            if recently_checked:
-                # Already checked in last 5 minutes, skip
+            # Atomically mark as checked; add() fails if the key already exists,
+            # i.e. the tenant was checked in the last 5 minutes by another worker
+            version = get_credit_check_cache_version()
+            cache_key = f"{self.CACHE_PREFIX}{tenant_id}"
+            if not cache.add(cache_key, True, self.CACHE_TIMEOUT, version=version):
                 return None
             
+            # Loaded together with the session user (TenantModelBackend)
+            tenant = request.user.tenant
+            
             # Attempt to deduct credit (will check last_credit_deducted internally)
             was_deducted = tenant.deduct_daily_credit()
             
@@ -59,12 +118,18 @@ class AutoCreditDeductionMiddleware(MiddlewareMixin):
                     f"Remaining credits: {tenant.credits}"
                 )
             
-            # Mark as checked in cache
-            cache.set(cache_key, True, self.CACHE_TIMEOUT)
-            
         except Exception as e:
             # Log error but don't block the request
             logger.error(f"Error in AutoCreditDeductionMiddleware: {str(e)}", exc_info=True)
+            
+            # Drop the markers so the next request retries instead of skipping for 5 minutes
+            if tenant_id:
+                self._unmark_checked_locally(tenant_id)
+            if cache_key is not None:
+                try:
+                    cache.delete(cache_key, version=version)
+                except Exception:
+                    logger.warning(f"Could not clear credit check marker {cache_key}", exc_info=True)
         
         return None
 
@@ -88,6 +153,8 @@ class CreditEnforcementMiddleware(MiddlewareMixin):
         '/static/',
         '/media/',
     ]
+    # str.startswith accepts a tuple and matches all prefixes in one C call
+    _EXEMPT_PREFIXES = tuple(EXEMPT_PATHS)
     
     def process_request(self, request):
         """
@@ -96,7 +163,7 @@ class CreditEnforcementMiddleware(MiddlewareMixin):
         try:
             # Check if path is exempt
             path = request.path
-            if any(path.startswith(exempt) for exempt in self.EXEMPT_PATHS):
+            if path.startswith(self._EXEMPT_PREFIXES):
                 return None
             
             # Only enforce for authenticated users
@@ -104,9 +171,11 @@ class CreditEnforcementMiddleware(MiddlewareMixin):
                 return None
             
             # Check if user has tenant
-            if not hasattr(request.user, 'tenant') or not request.user.tenant:
+            tenant_id = getattr(request.user, 'tenant_id', None)
+            if not tenant_id:
                 return None
             
+            # Loaded together with the session user (TenantModelBackend)
             tenant = request.user.tenant
             
             # Log warning if credits are low
@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-15 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('excel_data', '0035_add_last_credit_deducted'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='tenant',
+            index=models.Index(condition=models.Q(('credits__gt', 0), ('is_active', True)), fields=['is_active', 'credits', 'last_credit_deducted'], name='tenant_sched_idx'),
+        ),
+    ]
@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models import F, Value, Case, When, DateField, IntegerField
+from django.db.models.functions import ExtractDay, Least
 from django.utils.translation import gettext_lazy as _
 from django.core.exceptions import ValidationError
 from django.utils import timezone
@@ -10,6 +12,22 @@ import pytz
 
 logger = logging.getLogger(__name__)
 
+# Credit deductions are tracked against the Indian Standard Time calendar day
+IST = pytz.timezone('Asia/Kolkata')
+
+
+def _credits_to_deduct(today_ist):
+    """
+    SQL expression for the number of credits owed as of today_ist:
+    1 for a first-time deduction, otherwise one per missed day, capped at
+    the tenant's remaining credits.
+    """
+    days_missed = Case(
+        When(last_credit_deducted__isnull=True, then=Value(1)),
+        default=ExtractDay(Value(today_ist, output_field=DateField()) - F('last_credit_deducted')),
+    )
+    return Least(F('credits'), days_missed, output_field=IntegerField())
+
 
 class Tenant(models.Model):
     """
@@ -48,19 +66,25 @@ class Tenant(models.Model):
         verbose_name = _('tenant')
         verbose_name_plural = _('tenants')
         ordering = ['name']
+        indexes = [
+            # Partial index for the credit scheduler's eligible-tenant scan
+            models.Index(
+                fields=['is_active', 'credits', 'last_credit_deducted'],
+                name='tenant_sched_idx',
+                condition=models.Q(is_active=True, credits__gt=0),
+            ),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.subdomain}) - Credits: {self.credits}"
         
     def get_ist_time(self):
         """Get current time in Indian Standard Time"""
-        ist = pytz.timezone('Asia/Kolkata')
-        return timezone.now().astimezone(ist)
+        return timezone.now().astimezone(IST)
         
     def deduct_daily_credit(self):
         """Deduct credits for all missed days since last deduction"""
         from excel_data.models.auth import CustomUser
-        from datetime import timedelta
         
         now_ist = self.get_ist_time()
         today_ist = now_ist.date()
@@ -71,57 +95,93 @@ class Tenant(models.Model):
             logger.debug(f"Tenant {self.name} (ID: {self.id}) - Credit already deducted today ({self.last_credit_deducted})")
             return False
         
-        if self.credits > 0:
-            # Calculate number of days to deduct
-            if self.last_credit_deducted is None:
-                # First time deduction - only deduct 1 credit for today
-                days_to_deduct = 1
-            else:
-                # Calculate days between last deduction and today
-                days_diff = (today_ist - self.last_credit_deducted).days
-                days_to_deduct = days_diff  # Deduct for all missed days
-            
-            logger.info(
-                f"Tenant {self.name} (ID: {self.id}) - Attempting credit deduction. "
-                f"Last deducted: {self.last_credit_deducted}, Today: {today_ist}, "
-                f"Days to deduct: {days_to_deduct}"
+        with transaction.atomic():
+            # Conditional UPDATE is race-free without a SELECT FOR UPDATE:
+            # concurrent callers re-evaluate the WHERE clause after the row lock.
+            # Deactivation is folded into the same statement (SET expressions
+            # see the pre-update credits).
+            credits_owed = _credits_to_deduct(today_ist)
+            updated = Tenant.objects.filter(
+                pk=self.pk, credits__gt=0
+            ).exclude(
+                last_credit_deducted__gte=today_ist
+            ).update(
+                credits=F('credits') - credits_owed,
+                is_active=Case(
+                    When(credits__lte=credits_owed, then=Value(False)),
+                    default=F('is_active'),
+                ),
+                last_credit_deducted=today_ist,
             )
             
-            with transaction.atomic():
-                # Use select_for_update to prevent race conditions
-                tenant = Tenant.objects.select_for_update().get(pk=self.pk)
-                
-                # Double-check after acquiring lock
-                if tenant.last_credit_deducted and tenant.last_credit_deducted >= today_ist:
-                    logger.debug(f"Tenant {tenant.name} (ID: {tenant.id}) - Race condition avoided, already deducted")
-                    return False
-                
-                if tenant.credits > 0 and days_to_deduct > 0:
-                    # Deduct credits (but don't go below 0)
-                    credits_to_deduct = min(days_to_deduct, tenant.credits)
-                    tenant.credits -= credits_to_deduct
-                    tenant.last_credit_deducted = today_ist
-                    
-                    # Deactivate tenant if no credits left
-                    if tenant.credits == 0:
-                        tenant.is_active = False
-                        # Deactivate all users for this tenant
-                        CustomUser.objects.filter(tenant=tenant).update(is_active=False)
-                        logger.warning(
-                            f"🔴 Tenant {tenant.name} (ID: {tenant.id}) deactivated due to zero credits. "
-                            f"Deducted {credits_to_deduct} credits for {days_to_deduct} days"
-                        )
-                    
-                    tenant.save(update_fields=['credits', 'is_active', 'last_credit_deducted'])
-                    logger.info(
-                        f"✅ Deducted {credits_to_deduct} credit(s) from tenant {tenant.name} (ID: {tenant.id}) "
-                        f"for {days_to_deduct} day(s). Remaining: {tenant.credits}"
-                    )
-                    return True
-        else:
-            logger.debug(f"Tenant {self.name} (ID: {self.id}) - No credits available to deduct")
+            if not updated:
+                logger.debug(f"Tenant {self.name} (ID: {self.id}) - No credits available or already deducted")
+                return False
+            
+            self.refresh_from_db(fields=['credits', 'is_active', 'last_credit_deducted'])
+            
+            if self.credits == 0:
+                # Deactivate all users once the tenant row lock is released.
+                # Re-check the tenant state so a late callback cannot undo a
+                # reactivation by add_credits that committed in between.
+                transaction.on_commit(
+                    lambda: CustomUser.objects.filter(
+                        tenant_id=self.pk, tenant__is_active=False
+                    ).update(is_active=False)
+                )
+                logger.warning(f"🔴 Tenant {self.name} (ID: {self.id}) deactivated due to zero credits")
         
-        return False
+        logger.info(
+            f"✅ Deducted credit(s) from tenant {self.name} (ID: {self.id}) "
+            f"up to {today_ist}. Remaining: {self.credits}"
+        )
+        return True
+
+    @classmethod
+    def deduct_all_daily_credits(cls):
+        """
+        Deduct missed-day credits for every eligible tenant in a single UPDATE
+        and deactivate tenants (and their users) that run out of credits.
+
+        Returns a (deducted, deactivated) tuple of tenant counts.
+        """
+        from excel_data.models.auth import CustomUser
+
+        today_ist = timezone.now().astimezone(IST).date()
+
+        with transaction.atomic():
+            deducted = cls.objects.filter(
+                is_active=True, credits__gt=0
+            ).exclude(
+                last_credit_deducted__gte=today_ist
+            ).update(
+                credits=F('credits') - _credits_to_deduct(today_ist),
+                last_credit_deducted=today_ist,
+            )
+
+            if not deducted:
+                return 0, 0
+
+            exhausted = list(
+                cls.objects.filter(
+                    is_active=True, credits=0, last_credit_deducted=today_ist
+                ).values_list('id', 'name')
+            )
+            exhausted_ids = [tenant_id for tenant_id, _ in exhausted]
+            if exhausted_ids:
+                cls.objects.filter(id__in=exhausted_ids).update(is_active=False)
+                # Same strategy as deduct_daily_credit: deactivate users after
+                # commit, only for tenants that are still inactive by then
+                transaction.on_commit(
+                    lambda: CustomUser.objects.filter(
+                        tenant_id__in=exhausted_ids, tenant__is_active=False
+                    ).update(is_active=False)
+                )
+
+        for tenant_id, name in exhausted:
+            logger.warning(f"🔴 Tenant {name} (ID: {tenant_id}) deactivated due to zero credits")
+
+        return deducted, len(exhausted)
     
     def add_credits(self, amount):
         """Add credits to tenant and reactivate if needed"""
@@ -139,8 +199,13 @@ class Tenant(models.Model):
             if was_inactive and tenant.credits > 0:
                 tenant.is_active = True
                 from excel_data.models.auth import CustomUser
-                # Reactivate all users for this tenant
-                CustomUser.objects.filter(tenant=tenant).update(is_active=True)
+                # Reactivate all users for this tenant once the tenant row lock is released,
+                # skipping it if a later deduction has deactivated the tenant again
+                transaction.on_commit(
+                    lambda: CustomUser.objects.filter(
+                        tenant_id=tenant.pk, tenant__is_active=True
+                    ).update(is_active=True)
+                )
                 logger.info(f"Tenant {tenant.name} reactivated with {amount} credits")
             
             tenant.save(update_fields=['credits', 'is_active'])
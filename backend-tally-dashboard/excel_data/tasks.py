@@ -145,3 +145,17 @@ def cleanup_old_chart_data(days=90):
     logger.info(f"🗑️ [Celery] Cleaned up {deleted_count} old chart records")
     return {'deleted_count': deleted_count}
 
+
+@shared_task
+def process_all_credits_task():
+    """
+    Deduct daily credits for all active tenants.
+
+    Scheduled hourly and at midnight IST by Celery beat (see dashboard/celery.py)
+    when CREDIT_SCHEDULER_BACKEND='celery'; replaces the in-process CreditScheduler thread.
+    """
+    from excel_data.models import Tenant
+
+    deducted, deactivated = Tenant.deduct_all_daily_credits()
+    logger.info(f"💳 [Celery] Credit deduction: {deducted} tenants charged, {deactivated} deactivated")
+    return {'deducted': deducted, 'deactivated': deactivated}